@@ -6,19 +6,43 @@ from chaudiere import KeyValuePairs
 from chaudiere import Logger
 from chaudiere import ServiceInfo
 from chaudiere import Socket
-from chaudiere import StringTokenizer
-from chaudiere import StrUtils
+
+import threading
 
 #******************************************************************************
 #******************************************************************************
 
-class Messaging:
+# the Messaging instance (singleton), see Messaging.getMessaging/setMessaging
+_messagingInstance = None
+
+# upper bound on the number of idle pooled connections kept per service
+_MAX_IDLE_SOCKETS = 8
+
+class _MessagingType(type):
+   '''
+   * Metaclass of Messaging that keeps the Messaging.messagingInstance class attribute
+   * working, backed by the module-level singleton
+   '''
+   
+   @property
+   def messagingInstance(cls):
+      return _messagingInstance
+   
+   @messagingInstance.setter
+   def messagingInstance(cls, messaging):
+      global _messagingInstance
+      _messagingInstance = messaging
+
+# created by calling the metaclass, which works the same on Python 2 and 3
+_MessagingBase = _MessagingType('_MessagingBase', (object,), {'__slots__': ()})
+
+class Messaging(_MessagingBase):
+   
+   __slots__ = ('mapServices', 'socketPool', 'socketPoolLock')
    
    KEY_SERVICES = "services"
    KEY_HOST     = "host"
    KEY_PORT     = "port"
-   
-   messagingInstance = None
 
    '''
    * Initializes the messaging system by reading the specified INI configuration file
@@ -65,7 +89,7 @@ class Messaging:
    '''
    @staticmethod
    def getMessaging():
-      return Messaging.messagingInstance
+      return _messagingInstance
 
    '''
    * Sets the Messaging instance (singleton) to use after successfully reading configuration
@@ -73,7 +97,8 @@ class Messaging:
    '''
    @staticmethod
    def setMessaging(messaging):
-      Messaging.messagingInstance = messaging
+      global _messagingInstance
+      _messagingInstance = messaging
 
    '''
    * Determines if the messaging system has been initialized
@@ -81,13 +106,16 @@ class Messaging:
    '''
    @staticmethod
    def isInitialized():
-      return None != Messaging.getMessaging()
+      return _messagingInstance is not None
 
    '''
    * Constructs a new Messaging instance
    '''
    def __init__(self):
       self.mapServices = {}
+      # idle connections by service name; guarded by socketPoolLock
+      self.socketPool = {}
+      self.socketPoolLock = threading.Lock()
       
    '''
    * Registers a service with the messaging system
@@ -104,59 +132,278 @@ class Messaging:
    * @return boolean indicating if the service is registered
    '''
    def isServiceRegistered(self, serviceName):
-      return self.mapServices.has_key(serviceName)
+      return serviceName in self.mapServices
 
    '''
    * Retrieves configuration data for the specified service
    * @param serviceName the name of the service whose data is requested
-   * @return the ServiceInfo instance containing data for the service
+   * @return the ServiceInfo instance containing data for the service, or None if not registered
    * @see ServiceInfo()
    '''
    def getInfoForService(self, serviceName):
-      return self.mapServices[serviceName]
+      return self.mapServices.get(serviceName)
+
+   '''
+   * Opens a new socket connection for the specified service. The connection is not
+   * taken from the pool; hand it to checkInSocket to make it available for reuse.
+   * @param serviceName the name of the service whose connection is needed
+   * @return a Socket instance on success, None on failure
+   * @see Socket()
+   '''
+   def openSocket(self, serviceName):
+      serviceInfo = self.mapServices.get(serviceName)
+      if serviceInfo is None:
+         Logger.error("Messaging.openSocket: service is not registered")
+         return None
+      
+      try:
+         return Socket(serviceInfo.getHost(), serviceInfo.getPort())
+      except IOError:
+         return None
+
+   '''
+   * Checks out an idle pooled socket connection for the specified service. The socket
+   * is removed from the pool, so the caller has exclusive use of it until it is handed
+   * back with checkInSocket (or closed). Safe to call from multiple threads.
+   * @param serviceName the name of the service whose connection is needed
+   * @return a Socket instance, or None if no open pooled connection is available
+   * @see Socket()
+   '''
+   def checkOutSocket(self, serviceName):
+      with self.socketPoolLock:
+         idleSockets = self.socketPool.get(serviceName)
+         while idleSockets:
+            s = idleSockets.pop()
+            if s.isOpen():
+               return s
+      
+      return None
+
+   '''
+   * Returns a socket connection to the pool so that a later send to the same service
+   * can reuse it. Only sockets with no unread data on them may be checked in.
+   * Safe to call from multiple threads.
+   * @param serviceName the name of the service the connection belongs to
+   * @param s the Socket instance to return to the pool
+   '''
+   def checkInSocket(self, serviceName, s):
+      with self.socketPoolLock:
+         idleSockets = self.socketPool.setdefault(serviceName, [])
+         if len(idleSockets) < _MAX_IDLE_SOCKETS:
+            idleSockets.append(s)
+            return
+      
+      # enough idle connections pooled already
+      Messaging.closeSocket(s)
+
+   '''
+   * Closes all pooled socket connections, e.g. when shutting down. Sockets that are
+   * checked out at the time are not affected and are pooled again when checked in.
+   * Safe to call from multiple threads.
+   '''
+   def closeSockets(self):
+      with self.socketPoolLock:
+         pools = list(self.socketPool.values())
+         self.socketPool.clear()
+      
+      for idleSockets in pools:
+         for s in idleSockets:
+            Messaging.closeSocket(s)
+
+   '''
+   * Closes a socket connection that is not going to be reused
+   * @param s the Socket instance to close
+   '''
+   @staticmethod
+   def closeSocket(s):
+      try:
+         s.close()
+      except IOError:
+         pass
    
 #******************************************************************************
 #******************************************************************************
 
+# message type values, also exposed as MessageType class attributes. kept at
+# module level so that the message type checks on every message don't do a
+# class attribute lookup.
+_MT_UNKNOWN, _MT_KEY_VALUES, _MT_TEXT = range(3)
+
 class MessageType:
-   Unknown, KeyValues, Text = range(3)
+   Unknown   = _MT_UNKNOWN
+   KeyValues = _MT_KEY_VALUES
+   Text      = _MT_TEXT
+
+#******************************************************************************
+#******************************************************************************
+
+# wire format constants, also exposed as Message class attributes. kept at
+# module level so that the serialization code doesn't do a class attribute
+# lookup for each of them on every message.
+_MAX_SEGMENT_LENGTH      = 32767
+_NUM_CHARS_HEADER_LENGTH = 10
+# left-justified, space padded header length prefix
+_HEADER_LENGTH_FORMAT    = "<%dd" % _NUM_CHARS_HEADER_LENGTH
+
+_DELIMITER_KEY_VALUE     = "="
+_DELIMITER_PAIR          = ";"
+_EMPTY_STRING            = ""
+_KEY_ONE_WAY             = "1way"
+_KEY_PAYLOAD_LENGTH      = "payload_length"
+_KEY_PAYLOAD_TYPE        = "payload_type"
+_KEY_REQUEST_NAME        = "request"
+_VALUE_PAYLOAD_KVP       = "kvp"
+_VALUE_PAYLOAD_TEXT      = "text"
+_VALUE_PAYLOAD_UNKNOWN   = "unknown"
+_VALUE_TRUE              = "true"
+
+# upper bound on the number of released Message objects kept for reuse
+_MAX_FREE_MESSAGES       = 64
+
+# how much of a message reconstitute consumed from the socket (see Message.receiveState)
+_RECEIVE_NOTHING         = 0   # no bytes arrived, e.g. the peer had closed the connection
+_RECEIVE_PARTIAL         = 1   # bytes arrived, but data may be left unread on the socket
+_RECEIVE_COMPLETE        = 2   # the whole message was read
+
+# outcome of writing a message and reading its response (see Message.sendAndReceive)
+_EXCHANGE_OK             = 0   # a response was received
+_EXCHANGE_NO_RESPONSE    = 1   # the write failed or no response bytes arrived
+_EXCHANGE_FAILED         = 2   # a response began to arrive but wasn't usable
+
+'''
+ * Parses flattened key/value pairs ("k1=v1;k2=v2") into a list of (key, value) tuples.
+ * Pairs without a key/value delimiter are skipped. Kept free of any KeyValuePairs
+ * dependency so that the scanning is done entirely by the built-in string methods.
+ * @param s the textual data that holds the key/value pairs
+ * @return list of (key, value) tuples in the order they appear in s
+'''
+def _parsePairs(s):
+   pairs = []
+   for keyValuePair in s.split(_DELIMITER_PAIR):
+      key, delimiter, value = keyValuePair.partition(_DELIMITER_KEY_VALUE)
+      if delimiter:
+         pairs.append((key, value))
+   
+   return pairs
+
+'''
+ * Flattens (key, value) tuples into the "k1=v1;k2=v2" form parsed by _parsePairs
+ * @param pairs iterable of (key, value) tuples
+ * @return the string representation of the pairs
+'''
+def _pairsToString(pairs):
+   return _DELIMITER_PAIR.join([key + _DELIMITER_KEY_VALUE + value for key, value in pairs])
 
 #******************************************************************************
 #******************************************************************************
 
-class Message:
+class _HeaderPairs(object):
+   '''
+   * Write-through view of a message's headers with the KeyValuePairs interface,
+   * returned by Message.kvpHeaders. Changes are made directly to the message's header
+   * dict; KeyValuePairs methods that aren't provided here raise AttributeError.
+   '''
+   
+   __slots__ = ('mapHeaders',)
+   
+   def __init__(self, mapHeaders):
+      self.mapHeaders = mapHeaders
+   
+   def addPair(self, key, value):
+      self.mapHeaders[key] = value
+   
+   def hasKey(self, key):
+      return key in self.mapHeaders
+   
+   def getValue(self, key):
+      return self.mapHeaders[key]
+   
+   def getKeys(self):
+      return list(self.mapHeaders.keys())
+   
+   def removePair(self, key):
+      self.mapHeaders.pop(key, None)
+   
+   def empty(self):
+      return not self.mapHeaders
+   
+   def size(self):
+      return len(self.mapHeaders)
+   
+   def clear(self):
+      self.mapHeaders.clear()
+
+#******************************************************************************
+#******************************************************************************
+
+class Message(object):
     
-   MAX_SEGMENT_LENGTH       = 32767
-   NUM_CHARS_HEADER_LENGTH  = 10
+   MAX_SEGMENT_LENGTH       = _MAX_SEGMENT_LENGTH
+   NUM_CHARS_HEADER_LENGTH  = _NUM_CHARS_HEADER_LENGTH
 
-   DELIMITER_KEY_VALUE      = "="
-   DELIMITER_PAIR           = ";"
-   EMPTY_STRING             = ""
-   KEY_ONE_WAY              = "1way"
-   KEY_PAYLOAD_LENGTH       = "payload_length"
-   KEY_PAYLOAD_TYPE         = "payload_type"
-   KEY_REQUEST_NAME         = "request"
-   VALUE_PAYLOAD_KVP        = "kvp"
-   VALUE_PAYLOAD_TEXT       = "text"
-   VALUE_PAYLOAD_UNKNOWN    = "unknown"
-   VALUE_TRUE               = "true"
+   DELIMITER_KEY_VALUE      = _DELIMITER_KEY_VALUE
+   DELIMITER_PAIR           = _DELIMITER_PAIR
+   EMPTY_STRING             = _EMPTY_STRING
+   KEY_ONE_WAY              = _KEY_ONE_WAY
+   KEY_PAYLOAD_LENGTH       = _KEY_PAYLOAD_LENGTH
+   KEY_PAYLOAD_TYPE         = _KEY_PAYLOAD_TYPE
+   KEY_REQUEST_NAME         = _KEY_REQUEST_NAME
+   VALUE_PAYLOAD_KVP        = _VALUE_PAYLOAD_KVP
+   VALUE_PAYLOAD_TEXT       = _VALUE_PAYLOAD_TEXT
+   VALUE_PAYLOAD_UNKNOWN    = _VALUE_PAYLOAD_UNKNOWN
+   VALUE_TRUE               = _VALUE_TRUE
 
+   # released Message instances available for reuse (see acquire, release)
+   _freelist = []
 
    '''
     * Reconstructs a message by reading from a socket
     * @param socketConnection the socket to read from
-    * @return a new Message object instance constructed by reading data from socket
+    * @return a Message object instance constructed by reading data from socket. The
+    * instance may be reused from earlier released messages; callers in a receive loop
+    * can hand it back with Message.release once they are done with it.
     * @see Socket()
    '''
    @staticmethod
    def reconstruct(socketConnection):
       if (socketConnection != None) and socketConnection.isOpen():
-         message = Message()
+         message = Message.acquire()
          if message.reconstitute(socketConnection):
             return message
+         Message.release(message)
       
       return None
    
+   '''
+    * Retrieves a Message instance for receiving, reusing a previously released
+    * instance when one is available (used internally)
+    * @return a Message object instance in its initial (reset) state
+   '''
+   @classmethod
+   def acquire(cls):
+      # pop and check for empty in one step, other threads may be acquiring too
+      try:
+         message = cls._freelist.pop()
+      except IndexError:
+         return cls()
+      
+      message.isReleased = 0
+      message.reset()
+      return message
+   
+   '''
+    * Returns a Message instance so that it can be reused by a later acquire (e.g.,
+    * by reconstruct). The message must not be used by the caller after it is released.
+    * Releasing a message that is already released has no effect.
+    * @param message the Message object instance that is no longer needed
+   '''
+   @classmethod
+   def release(cls, message):
+      if (message is not None) and not message.isReleased:
+         if len(cls._freelist) < _MAX_FREE_MESSAGES:
+            message.isReleased = 1
+            cls._freelist.append(message)
+   
    '''
     * Constructs a message in anticipation of sending it
     * @param requestName the name of the message request
@@ -165,65 +412,150 @@ class Message:
    def __init__(self, requestName=None, messageType=MessageType.Unknown):
       self.messageType = messageType
       self.isOneWay = 0
-      self.kvpHeaders = KeyValuePairs()
+      # set while the instance is on the free list (see release)
+      self.isReleased = 0
+      # headers are internal to the message and kept in a plain dict
+      self.mapHeaders = {}
       if requestName is not None:
-         self.kvpHeaders.addPair(Message.KEY_REQUEST_NAME, requestName)
+         self.mapHeaders[_KEY_REQUEST_NAME] = requestName
+      self.textPayload = None
+      self.kvpPayload = None
+      # received key/values payload, turned into KeyValuePairs on request
+      self.mapPayload = None
+      # set by reconstitute (used internally by send to decide if a socket can be reused)
+      self.receiveState = _RECEIVE_NOTHING
    
    '''
-    * Sends a message to the specified service and disregards any response that the
-    * server handler might generate.
+    * Clears the message state so that the instance can be reused
+   '''
+   def reset(self):
+      self.messageType = _MT_UNKNOWN
+      self.isOneWay = 0
+      self.mapHeaders.clear()
+      self.textPayload = None
+      self.kvpPayload = None
+      self.mapPayload = None
+      self.receiveState = _RECEIVE_NOTHING
+   
+   '''
+    * Sends a message to the specified service. When a response message is given,
+    * the call is synchronous and the response is read into it; otherwise the message
+    * is sent one-way and any response that the server handler might generate is disregarded.
+    *
+    * Synchronous sends reuse pooled connections. Each send checks a connection out of the
+    * pool for its exclusive use, so concurrent sends from multiple threads never share a
+    * socket. One-way sends always use a new connection that is closed afterwards, since a
+    * response left unread on the socket would otherwise be read by the next send.
     * @param serviceName the name of the service destination
-    * @return boolean indicating if message was successfully delivered
+    * @param responseMessage the message object instance to populate with the response, or None for one-way
+    * @return boolean indicating if the message was successfully delivered (and a response received, if requested)
    '''
-   def send(self, serviceName):
-      if self.messageType == MessageType.Unknown:
+   def send(self, serviceName, responseMessage=None):
+      if self.messageType == _MT_UNKNOWN:
          Logger.error("Message.send: unable to send message, no message type set")
          return 0
-
-      socketConnection = Message.socketForService(serviceName)
    
-      if socketConnection is not None:
-         self.isOneWay = 1
+      self.isOneWay = 1 if responseMessage is None else 0
       
-         if socketConnection.write(self.toString()):
+      payload = self.toString()
+      if Logger.isLogging(Logger.LogLevel.Verbose):
+         Logger.verbose("Message.send: payload: '" + payload + "'")
+      
+      if responseMessage is None:
+         socketConnection = Message.socketForService(serviceName)
+         if socketConnection is None:
+            # unable to connect to service
+            Logger.error("Message.send: unable to connect to service")
+            return 0
+         
+         try:
+            isWritten = socketConnection.write(payload)
+         except IOError:
+            isWritten = 0
+         Messaging.closeSocket(socketConnection)
+         
+         if isWritten:
             return 1
          else:
             # unable to write to socket
             Logger.error("Message.send: unable to write to socket")
-      else:
+            return 0
+      
+      socketConnection = Message.pooledSocketForService(serviceName)
+      if socketConnection is not None:
+         result = Message.sendAndReceive(socketConnection, payload, responseMessage)
+         if result != _EXCHANGE_NO_RESPONSE:
+            return Message.finishExchange(serviceName, socketConnection, responseMessage, result)
+         
+         # nothing came back on the pooled connection, most likely because the server
+         # closed it while it was idle. retry once on a new connection. this is only done
+         # when no response bytes arrived, so a request the server did answer isn't repeated.
+         Logger.debug("Message.send: no response on pooled connection, retrying on a new connection")
+         Messaging.closeSocket(socketConnection)
+         responseMessage.reset()
+      
+      socketConnection = Message.socketForService(serviceName)
+      if socketConnection is None:
          # unable to connect to service
          Logger.error("Message.send: unable to connect to service")
-   
-      return 0
+         return 0
+      
+      result = Message.sendAndReceive(socketConnection, payload, responseMessage)
+      return Message.finishExchange(serviceName, socketConnection, responseMessage, result)
    
    '''
-    * Sends a message and retrieves the message response (synchronous call)
-    * @param serviceName the name of the service destination
+    * Writes a flattened message to a socket and reads the response from it (used internally)
+    * @param socketConnection the socket to use
+    * @param payload the flattened message to write
     * @param responseMessage the message object instance to populate with the response
-    * @return boolean indicating if the message was successfully delivered and a response received
+    * @return _EXCHANGE_OK if a response was received, _EXCHANGE_NO_RESPONSE if the write
+    * failed or no response bytes arrived, _EXCHANGE_FAILED if the response was unusable
    '''
-   def send(self, serviceName, responseMessage):
-      if self.messageType == MessageType.Unknown:
-         Logger.error("Message.send: unable to send message, no message type set")
-         return 0
-   
-      socketConnection = Message.socketForService(serviceName)
+   @staticmethod
+   def sendAndReceive(socketConnection, payload, responseMessage):
+      # a connection closed by the peer usually shows up as an exception (EPIPE,
+      # ECONNRESET) rather than a failed return. socket.error is a subclass of IOError.
+      try:
+         isWritten = socketConnection.write(payload)
+      except IOError:
+         isWritten = 0
+      
+      if not isWritten:
+         # unable to write to socket
+         Logger.error("Message.send: unable to write to socket")
+         return _EXCHANGE_NO_RESPONSE
+      
+      try:
+         if responseMessage.reconstitute(socketConnection):
+            return _EXCHANGE_OK
+      except IOError:
+         Logger.error("Message.send: error reading response from socket")
+      
+      if responseMessage.receiveState == _RECEIVE_NOTHING:
+         return _EXCHANGE_NO_RESPONSE
+      else:
+         return _EXCHANGE_FAILED
    
-      if socketConnection is not None:
-         #if Logger.isLogging(Logger.LogLevel.Verbose):
-         payload = self.toString()
-         Logger.verbose("Message.send: payload: '" + payload + "'")
+   '''
+    * Pools or closes the socket used by a synchronous send once it is done with (used internally)
+    * @param serviceName the name of the service the connection belongs to
+    * @param socketConnection the socket used for the send
+    * @param responseMessage the message object instance populated with the response
+    * @param result the result returned by sendAndReceive
+    * @return boolean indicating if the message was delivered and a response received
+   '''
+   @staticmethod
+   def finishExchange(serviceName, socketConnection, responseMessage, result):
+      if (result == _EXCHANGE_OK) and (responseMessage.receiveState == _RECEIVE_COMPLETE):
+         Message.returnSocketForService(serviceName, socketConnection)
+      else:
+         # broken, or part of the response is still on the socket, it can't be reused
+         Messaging.closeSocket(socketConnection)
       
-         if socketConnection.write(payload):
-            return responseMessage.reconstitute(socketConnection)
-         else:
-            # unable to write to socket
-            Logger.error("Message.send: unable to write to socket")
+      if result == _EXCHANGE_OK:
+         return 1
       else:
-         # unable to connect to service
-         Logger.error("Message.send: unable to connect to service")
-
-      return 0
+         return 0
    
    '''
     * Reconstitute a message by reading message state data from a socket (used internally)
@@ -232,65 +564,82 @@ class Message:
     * @see Socket()
    '''
    def reconstitute(self, socketConnection):
+      self.receiveState = _RECEIVE_NOTHING
+      
       if socketConnection is not None:
-         if self.kvpHeaders is None:
-            self.kvpHeaders = KeyValuePairs()
-         
-         headerLengthPrefix = socketConnection.readSocket(Message.NUM_CHARS_HEADER_LENGTH)
+         headerLengthPrefix = socketConnection.readSocket(_NUM_CHARS_HEADER_LENGTH)
+         if headerLengthPrefix:
+            self.receiveState = _RECEIVE_PARTIAL
+            if len(headerLengthPrefix) < _NUM_CHARS_HEADER_LENGTH:
+               rest = Message.readSocketFully(socketConnection, _NUM_CHARS_HEADER_LENGTH - len(headerLengthPrefix))
+               if rest is not None:
+                  headerLengthPrefix += rest
       
-         if headerLengthPrefix is not None and len(headerLengthPrefix) == Message.NUM_CHARS_HEADER_LENGTH:
+         if headerLengthPrefix is not None and len(headerLengthPrefix) == _NUM_CHARS_HEADER_LENGTH:
          
-            headerLengthPrefix = StrUtils.stripTrailing(headerLengthPrefix, ' ')
-            Logger.verbose("Message.reconstitute: headerLengthPrefix read: '" + headerLengthPrefix + "'")
-            headerLength = int(headerLengthPrefix)
+            if Logger.isLogging(Logger.LogLevel.Verbose):
+               Logger.verbose("Message.reconstitute: headerLengthPrefix read: '" + headerLengthPrefix + "'")
+            # int() ignores the trailing space padding
+            try:
+               headerLength = int(headerLengthPrefix)
+            except ValueError:
+               Logger.error("Message.reconstitute: invalid header length prefix")
+               return 0
          
             if headerLength > 0:
-               headersAsString = socketConnection.readSocket(headerLength)
+               headersAsString = Message.readSocketFully(socketConnection, headerLength)
                
                if headersAsString is None or len(headersAsString) != headerLength:
                   Logger.error("Message.reconstitute: reading socket for header failed")
                   return 0
             
                if len(headersAsString) > 0:
-                  Logger.verbose("Message.reconstitute: headersAsString: '" + headersAsString + "'")
+                  if Logger.isLogging(Logger.LogLevel.Verbose):
+                     Logger.verbose("Message.reconstitute: headersAsString: '" + headersAsString + "'")
                   
-                  if self.fromString(headersAsString, self.kvpHeaders):
-                     if self.kvpHeaders.hasKey(Message.KEY_PAYLOAD_TYPE):
-                        valuePayloadType = self.kvpHeaders.getValue(Message.KEY_PAYLOAD_TYPE)
+                  pairs = _parsePairs(headersAsString)
+                  if pairs:
+                     headers = self.mapHeaders
+                     headers.update(pairs)
                      
-                        if valuePayloadType == Message.VALUE_PAYLOAD_TEXT:
-                           self.messageType = MessageType.Text
-                        elif valuePayloadType == Message.VALUE_PAYLOAD_KVP:
-                           self.messageType = MessageType.KeyValues
+                     valuePayloadType = headers.get(_KEY_PAYLOAD_TYPE)
+                     if valuePayloadType == _VALUE_PAYLOAD_TEXT:
+                        self.messageType = _MT_TEXT
+                     elif valuePayloadType == _VALUE_PAYLOAD_KVP:
+                        self.messageType = _MT_KEY_VALUES
                   
-                     if self.messageType == MessageType.Unknown:
+                     if self.messageType == _MT_UNKNOWN:
                         Logger.error("Message.reconstitute: unable to identify message type from header")
                         return 0
                   
-                     if self.kvpHeaders.hasKey(Message.KEY_PAYLOAD_LENGTH):
-                        valuePayloadLength = self.kvpHeaders.getValue(Message.KEY_PAYLOAD_LENGTH)
-                     
+                     valuePayloadLength = headers.get(_KEY_PAYLOAD_LENGTH)
+                     if valuePayloadLength is not None:
                         if len(valuePayloadLength) > 0:
-                           payloadLength = int(valuePayloadLength)
-                        
-                           if (payloadLength > 0) and (payloadLength <= Message.MAX_SEGMENT_LENGTH):
-                              payloadAsString = socketConnection.readSocket(payloadLength)
+                           try:
+                              payloadLength = int(valuePayloadLength)
+                           except ValueError:
+                              Logger.error("Message.reconstitute: invalid payload length")
+                              return 0
+                           
+                           if payloadLength == 0:
+                              self.receiveState = _RECEIVE_COMPLETE
+                           elif (payloadLength > 0) and (payloadLength <= _MAX_SEGMENT_LENGTH):
+                              payloadAsString = Message.readSocketFully(socketConnection, payloadLength)
                               if payloadAsString is None or len(payloadAsString) != payloadLength:
                                  Logger.error("Message.reconstitute: reading socket for payload failed")
                                  return 0
                            
+                              self.receiveState = _RECEIVE_COMPLETE
                               if len(payloadAsString) > 0:
-                                 if self.messageType == MessageType.Text:
+                                 if self.messageType == _MT_TEXT:
                                     self.textPayload = payloadAsString
-                                 elif self.messageType == MessageType.KeyValues:
-                                    self.kvpPayload = KeyValuePairs()
-                                    self.fromString(payloadAsString, self.kvpPayload)
+                                 elif self.messageType == _MT_KEY_VALUES:
+                                    self.mapPayload = dict(_parsePairs(payloadAsString))
+                                    self.kvpPayload = None
                   
-                     if self.kvpHeaders.hasKey(Message.KEY_ONE_WAY):
-                        valueOneWay = self.kvpHeaders.getValue(Message.KEY_ONE_WAY)
-                        if valueOneWay == Message.VALUE_TRUE:
-                           # mark it as being a 1-way message
-                           self.isOneWay = 1
+                     if headers.get(_KEY_ONE_WAY) == _VALUE_TRUE:
+                        # mark it as being a 1-way message
+                        self.isOneWay = 1
                   
                      return 1
                   else:
@@ -330,10 +679,54 @@ class Message:
     * @return the name of the message request
    '''
    def getRequestName(self):
-      if (self.kvpHeaders is not None) and self.kvpHeaders.hasKey(Message.KEY_REQUEST_NAME):
-         return self.kvpHeaders.getValue(Message.KEY_REQUEST_NAME)
-      else:
-         return Message.EMPTY_STRING
+      return self.mapHeaders.get(_KEY_REQUEST_NAME, _EMPTY_STRING)
+   
+   '''
+    * Sets a message header
+    * @param key the name of the header
+    * @param value the (string) value of the header
+   '''
+   def setHeader(self, key, value):
+      self.mapHeaders[key] = value
+   
+   '''
+    * Retrieves a message header
+    * @param key the name of the header
+    * @return the value of the header, or None if the header isn't set
+   '''
+   def getHeader(self, key):
+      return self.mapHeaders.get(key)
+   
+   '''
+    * Determines if a message header is set
+    * @param key the name of the header
+    * @return boolean indicating if the header is set
+   '''
+   def hasHeader(self, key):
+      return key in self.mapHeaders
+   
+   '''
+    * Retrieves the message headers through the KeyValuePairs interface (kept for code
+    * that uses message.kvpHeaders). The returned object is a write-through view: addPair,
+    * removePair and clear change the message headers directly.
+    * @return a KeyValuePairs-like view of the message headers
+    * @see KeyValuePairs()
+   '''
+   @property
+   def kvpHeaders(self):
+      return _HeaderPairs(self.mapHeaders)
+   
+   '''
+    * Replaces the message headers with the contents of a KeyValuePairs object
+    * @param kvp the new headers
+    * @see KeyValuePairs()
+   '''
+   @kvpHeaders.setter
+   def kvpHeaders(self, kvp):
+      self.mapHeaders.clear()
+      if kvp is not None:
+         for key in kvp.getKeys():
+            self.mapHeaders[key] = kvp.getValue(key)
    
    '''
     * Retrieves the key/values payload associated with the message
@@ -341,6 +734,12 @@ class Message:
     * @see KeyValuePairs()
    '''
    def getKeyValuesPayload(self):
+      if (self.kvpPayload is None) and (self.mapPayload is not None):
+         kvp = KeyValuePairs()
+         for key, value in self.mapPayload.items():
+            kvp.addPair(key, value)
+         self.kvpPayload = kvp
+      
       return self.kvpPayload
    
    '''
@@ -357,6 +756,7 @@ class Message:
    '''
    def setKeyValuesPayload(self, kvp):
       self.kvpPayload = kvp
+      self.mapPayload = None
    
    '''
     * Sets the textual payload associated with the message
@@ -378,39 +778,37 @@ class Message:
    '''
    #@Override
    def toString(self):
-      kvpHeaders = self.kvpHeaders  #KeyValuePairs(self.kvpHeaders)
+      headers = self.mapHeaders
       payload = ""
    
-      if self.messageType == MessageType.Text:
-         kvpHeaders.addPair(Message.KEY_PAYLOAD_TYPE, Message.VALUE_PAYLOAD_TEXT)
+      if self.messageType == _MT_TEXT:
+         headers[_KEY_PAYLOAD_TYPE] = _VALUE_PAYLOAD_TEXT
          payload = self.textPayload
-      elif self.messageType == MessageType.KeyValues:
-         kvpHeaders.addPair(Message.KEY_PAYLOAD_TYPE, Message.VALUE_PAYLOAD_KVP)
-         payload = self.kvpToString(self.kvpPayload)
+      elif self.messageType == _MT_KEY_VALUES:
+         headers[_KEY_PAYLOAD_TYPE] = _VALUE_PAYLOAD_KVP
+         if self.kvpPayload is not None:
+            payload = self.kvpToString(self.kvpPayload)
+         elif self.mapPayload:
+            payload = _pairsToString(self.mapPayload.items())
       else:
-         kvpHeaders.addPair(Message.KEY_PAYLOAD_TYPE, Message.VALUE_PAYLOAD_UNKNOWN)
+         headers[_KEY_PAYLOAD_TYPE] = _VALUE_PAYLOAD_UNKNOWN
    
       if self.isOneWay:
-         kvpHeaders.addPair(Message.KEY_ONE_WAY, Message.VALUE_TRUE)
-   
-      if self.kvpHeaders.hasKey(Message.KEY_REQUEST_NAME):
-         kvpHeaders.addPair(Message.KEY_REQUEST_NAME, self.kvpHeaders.getValue(Message.KEY_REQUEST_NAME))
+         headers[_KEY_ONE_WAY] = _VALUE_TRUE
       else:
-         kvpHeaders.addPair(Message.KEY_REQUEST_NAME, "")
+         # the message may have been sent one-way before
+         headers.pop(_KEY_ONE_WAY, None)
+   
+      if _KEY_REQUEST_NAME not in headers:
+         headers[_KEY_REQUEST_NAME] = _EMPTY_STRING
 
-      kvpHeaders.addPair(Message.KEY_PAYLOAD_LENGTH, str(len(payload)))
+      headers[_KEY_PAYLOAD_LENGTH] = str(len(payload))
       
-      headersAsString = self.kvpToString(kvpHeaders)
+      headersAsString = _pairsToString(headers.items())
 
-      headerLengthPrefix = self.encodeLength(len(headersAsString))
-      headerLengthPrefix = StrUtils.padRight(headerLengthPrefix, ' ', Message.NUM_CHARS_HEADER_LENGTH)
+      headerLengthPrefix = format(len(headersAsString), _HEADER_LENGTH_FORMAT)
 
-      messageAsString = ""
-      messageAsString += headerLengthPrefix
-      messageAsString += headersAsString
-      messageAsString += payload
-   
-      return messageAsString
+      return "".join((headerLengthPrefix, headersAsString, payload))
    
    '''
     * Flatten a KeyValuePairs object as part of flattening the Message
@@ -419,24 +817,10 @@ class Message:
    '''
    @staticmethod
    def kvpToString(kvp):
-      kvpAsString = ""
+      if (kvp is None) or kvp.empty():
+         return _EMPTY_STRING
    
-      if (kvp is not None) and not kvp.empty():
-         keys = kvp.getKeys()
-         i = 0
-      
-         for key in keys:
-            if i > 0:
-               # append pair delimiter
-               kvpAsString += Message.DELIMITER_PAIR
-         
-            kvpAsString += key
-            kvpAsString += Message.DELIMITER_KEY_VALUE
-            kvpAsString += kvp.getValue(key)
-         
-            i += 1
-      
-      return kvpAsString
+      return _pairsToString([(key, kvp.getValue(key)) for key in kvp.getKeys()])
    
    '''
     * Reconstitutes the state of a KeyValuePairs from the specified string
@@ -447,90 +831,87 @@ class Message:
    '''
    @staticmethod
    def fromString(s, kvp):
-      numPairsAdded = 0
-      
       if (s is not None) and (kvp is not None) and (len(s) > 0):
-         stPairs = StringTokenizer(s, Message.DELIMITER_PAIR)
-         numPairs = stPairs.countTokens()
-      
-         if numPairs > 0:
-            while stPairs.hasMoreTokens():
-               keyValuePair = stPairs.nextToken()
-            
-               stKeyValue = StringTokenizer(keyValuePair, Message.DELIMITER_KEY_VALUE)
-               numTokens = stKeyValue.countTokens()
-               if numTokens == 2:
-                  key = stKeyValue.nextToken()
-                  value = stKeyValue.nextToken()
-                  kvp.addPair(key, value)
-                  numPairsAdded += 1
-               else:
-                  Logger.debug("Message.fromString: numTokens = " + str(numTokens))
-         else:
-            Logger.debug("Message.fromString: no pairs found with string tokenizer")
+         pairs = _parsePairs(s)
+         if pairs:
+            for key, value in pairs:
+               kvp.addPair(key, value)
+            return 1
+         
+         Logger.debug("Message.fromString: no key/value pairs found")
       else:
          Logger.debug("Message.fromString: condition failed: (s is not None) and (kvp is not None) and (len(s) > 0)")
    
-      return numPairsAdded > 0
-   
-   '''
-    * Encodes a length to a string so that it can be encoded in flattened message (used internally)
-    * @param lengthBytes the length in bytes to encode
-    * @return the string representation of the length
-   '''
-   @staticmethod
-   def encodeLength(lengthBytes):
-      return StrUtils.padRight(str(lengthBytes), ' ', Message.NUM_CHARS_HEADER_LENGTH)
+      return 0
    
    '''
-    * Decodes the length of the message header by reading from a socket (used internally)
+    * Reads exactly the requested number of bytes from a socket, issuing further reads
+    * when the socket returns fewer bytes than requested (used internally)
     * @param socketConnection the socket to read from
-    * @return the decoded length of the message header
+    * @param numBytes the number of bytes to read
+    * @return the data read, or None if the socket read failed before all data was read
     * @see Socket()
    '''
    @staticmethod
-   def decodeLength(socketConnection):
-      lengthBytes = 0
-   
-      if socketConnection is not None:
-         lengthAsChars = socketConnection.readSocket(Message.NUM_CHARS_HEADER_LENGTH)
-         if len(lengthAsChars) == Message.NUM_CHARS_HEADER_LENGTH:
-            encodedLength = String(lengthAsChars)
-            return int(encodedLength)
-   
-      return lengthBytes
+   def readSocketFully(socketConnection, numBytes):
+      data = socketConnection.readSocket(numBytes)
+      if not data:
+         return None
+      
+      numBytesRead = len(data)
+      if numBytesRead >= numBytes:
+         return data
+      
+      chunks = [data]
+      while numBytesRead < numBytes:
+         data = socketConnection.readSocket(numBytes - numBytesRead)
+         if not data:
+            return None
+         chunks.append(data)
+         numBytesRead += len(data)
+      
+      return "".join(chunks)
    
    '''
-    * Retrieves a socket connection for the specified service (used internally)
+    * Opens a new socket connection for the specified service (used internally)
     * @param serviceName the name of the service whose connection is needed
     * @return a Socket instance on success, None on failure
    '''
    @staticmethod
    def socketForService(serviceName):
-      if Messaging.isInitialized():
-         messaging = Messaging.getMessaging()
+      messaging = _messagingInstance
+      if messaging is None:
+         Logger.error("Message.socketForService: messaging not initialized")
+         return None
       
-         if messaging is not None:
-            if messaging.isServiceRegistered(serviceName):
-               serviceInfo = messaging.getInfoForService(serviceName)
-               name = serviceInfo.getServiceName()
-               host = serviceInfo.getHost()
-               port = serviceInfo.getPort()
-               s = None
-               try:
-                  s = Socket(host, port)
-               except IOError:
-                  s = None
-               
-               return s
-            else:
-               Logger.error("Message.socketForService: service is not registered")
-         else:
-            Logger.error("Message.socketForService: Messaging.getMessaging returned None, but isInitialized returns true")
+      # openSocket checks that the service is registered
+      return messaging.openSocket(serviceName)
+
+   '''
+    * Checks out a pooled socket connection for the specified service (used internally)
+    * @param serviceName the name of the service whose connection is needed
+    * @return a Socket instance for exclusive use by the caller, or None if none is pooled
+   '''
+   @staticmethod
+   def pooledSocketForService(serviceName):
+      messaging = _messagingInstance
+      if messaging is None:
+         return None
+      
+      return messaging.checkOutSocket(serviceName)
+
+   '''
+    * Returns a socket connection to the pool once its response has been read (used internally)
+    * @param serviceName the name of the service the connection belongs to
+    * @param socketConnection the socket to return to the pool
+   '''
+   @staticmethod
+   def returnSocketForService(serviceName, socketConnection):
+      messaging = _messagingInstance
+      if messaging is not None:
+         messaging.checkInSocket(serviceName, socketConnection)
       else:
-         Logger.error("Message.socketForService: messaging not initialized")
-   
-      return None
+         Messaging.closeSocket(socketConnection)
 
 #******************************************************************************
 #******************************************************************************
@@ -0,0 +1,405 @@
+# Copyright Paul Dardeau, SwampBits LLC 2014
+# BSD License
+
+import errno
+import os
+import socket
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from chaudiere import KeyValuePairs
+from chaudiere import ServiceInfo
+import tonnerre
+from tonnerre import Message
+from tonnerre import MessageType
+from tonnerre import Messaging
+
+#******************************************************************************
+#******************************************************************************
+
+class StringReader:
+   '''
+   * Minimal stand-in for a Socket that serves reads from a string
+   '''
+   def __init__(self, data):
+      self.data = data
+
+   def isOpen(self):
+      return 1
+
+   def readSocket(self, numBytes):
+      chunk = self.data[:numBytes]
+      self.data = self.data[numBytes:]
+      return chunk
+
+#******************************************************************************
+
+class FakeServer:
+   '''
+   * Simulated echo service. Replies with the upper-cased text payload.
+   '''
+   def __init__(self, closeAfterRequest=0, replyToOneWay=0, closedPeerError=None):
+      self.closeAfterRequest = closeAfterRequest
+      # None, 'write' or 'read': where a closed connection raises socket.error
+      self.closedPeerError = closedPeerError
+      self.replyToOneWay = replyToOneWay
+      self.requests = []
+      self.connectionsOpened = 0
+      # request name -> raw reply to send instead of the echo response
+      self.rawReplies = {}
+      self.lock = threading.Lock()
+
+#******************************************************************************
+
+class FakeSocket:
+   '''
+   * Client side of a connection to the FakeServer, used in place of chaudiere's Socket
+   '''
+   server = None
+
+   def __init__(self, host, port):
+      self.server = FakeSocket.server
+      self.server.connectionsOpened += 1
+      self.received = ""
+      self.closed = 0
+      self.peerClosed = 0
+
+   def isOpen(self):
+      return not self.closed
+
+   def close(self):
+      self.closed = 1
+
+   def write(self, payload):
+      if self.closed:
+         return 0
+      if self.peerClosed:
+         if self.server.closedPeerError == 'write':
+            raise socket.error(errno.EPIPE, 'Broken pipe')
+         # like TCP, the write is accepted locally but the data never arrives
+         return 1
+
+      request = Message()
+      request.reconstitute(StringReader(payload))
+      with self.server.lock:
+         self.server.requests.append(request.getTextPayload())
+
+      if request.getRequestName() in self.server.rawReplies:
+         self.received += self.server.rawReplies[request.getRequestName()]
+      elif (not request.isOneWay) or self.server.replyToOneWay:
+         response = Message(request.getRequestName(), MessageType.Text)
+         response.setTextPayload(request.getTextPayload().upper())
+         self.received += response.toString()
+
+      if self.server.closeAfterRequest:
+         self.peerClosed = 1
+
+      return 1
+
+   def readSocket(self, numBytes):
+      if self.peerClosed and not self.received and (self.server.closedPeerError == 'read'):
+         raise socket.error(errno.ECONNRESET, 'Connection reset by peer')
+      chunk = self.received[:numBytes]
+      self.received = self.received[numBytes:]
+      return chunk
+
+#******************************************************************************
+#******************************************************************************
+
+class TestMessagingSocketPool(unittest.TestCase):
+
+   def setUp(self):
+      self.savedSocket = tonnerre.Socket
+      tonnerre.Socket = FakeSocket
+      messaging = Messaging()
+      messaging.registerService('echo', ServiceInfo('echo', 'localhost', 9000))
+      Messaging.setMessaging(messaging)
+
+   def tearDown(self):
+      tonnerre.Socket = self.savedSocket
+      Messaging.setMessaging(None)
+
+   def sendText(self, requestName, text):
+      msg = Message(requestName, MessageType.Text)
+      msg.setTextPayload(text)
+      response = Message()
+      return msg.send('echo', response), response
+
+   def sendOneWay(self, requestName, text):
+      msg = Message(requestName, MessageType.Text)
+      msg.setTextPayload(text)
+      return msg.send('echo')
+
+   def testServerClosingAfterEachRequest(self):
+      FakeSocket.server = FakeServer(closeAfterRequest=1)
+      for i in range(4):
+         isSent, response = self.sendText('echo', 'msg%d' % i)
+         self.assertTrue(isSent)
+         self.assertEqual('MSG%d' % i, response.getTextPayload())
+
+   def testOneWayAfterServerClosedPooledConnection(self):
+      FakeSocket.server = FakeServer(closeAfterRequest=1)
+      self.sendText('echo', 'first')
+      self.assertTrue(self.sendOneWay('oneway', 'second'))
+      self.assertEqual(['first', 'second'], FakeSocket.server.requests)
+
+   def testOneWayResponseNotReadBySyncSend(self):
+      FakeSocket.server = FakeServer(replyToOneWay=1)
+      self.sendText('echo', 'warmup')
+      self.assertTrue(self.sendOneWay('oneway', 'oneway'))
+      isSent, response = self.sendText('sync', 'sync')
+      self.assertTrue(isSent)
+      self.assertEqual('sync', response.getRequestName())
+      self.assertEqual('SYNC', response.getTextPayload())
+
+   def testConnectionReused(self):
+      FakeSocket.server = FakeServer()
+      for i in range(3):
+         self.sendText('echo', 'msg%d' % i)
+      self.assertEqual(1, FakeSocket.server.connectionsOpened)
+
+   def testResendAsSyncClearsOneWayHeader(self):
+      FakeSocket.server = FakeServer()
+      msg = Message('echo', MessageType.Text)
+      msg.setTextPayload('again')
+      msg.send('echo')
+      response = Message()
+      self.assertTrue(msg.send('echo', response))
+      self.assertEqual('AGAIN', response.getTextPayload())
+
+   def testOversizedPayloadLeavesSocketOutOfPool(self):
+      FakeSocket.server = FakeServer()
+      big = Message('big', MessageType.Text)
+      big.setTextPayload('B' * 40000)
+      FakeSocket.server.rawReplies['big'] = big.toString()
+      isSent, response = self.sendText('big', 'big')
+      self.assertTrue(isSent)
+      self.assertEqual(None, response.getTextPayload())
+      isSent, response = self.sendText('echo', 'next')
+      self.assertTrue(isSent)
+      self.assertEqual('NEXT', response.getTextPayload())
+      self.assertEqual(2, FakeSocket.server.connectionsOpened)
+
+   def testInvalidLengthPrefixFailsMessage(self):
+      FakeSocket.server = FakeServer()
+      FakeSocket.server.rawReplies['bad'] = 'BBBBBBBBBBBBBBBBBBBB'
+      isSent, response = self.sendText('bad', 'bad')
+      self.assertFalse(isSent)
+      isSent, response = self.sendText('echo', 'next')
+      self.assertTrue(isSent)
+      self.assertEqual('NEXT', response.getTextPayload())
+
+   def testUnusableReplyOnPooledSocketNotRetried(self):
+      FakeSocket.server = FakeServer()
+      self.sendText('echo', 'warmup')
+      FakeSocket.server.rawReplies['transfer'] = Message('transfer').toString()
+      isSent, response = self.sendText('transfer', 'transfer')
+      self.assertFalse(isSent)
+      self.assertEqual(1, FakeSocket.server.requests.count('transfer'))
+
+   def testWriteErrorOnPooledSocketRetried(self):
+      FakeSocket.server = FakeServer(closeAfterRequest=1, closedPeerError='write')
+      for i in range(3):
+         isSent, response = self.sendText('echo', 'msg%d' % i)
+         self.assertTrue(isSent)
+         self.assertEqual('MSG%d' % i, response.getTextPayload())
+
+   def testReadErrorOnPooledSocketRetried(self):
+      FakeSocket.server = FakeServer(closeAfterRequest=1, closedPeerError='read')
+      for i in range(3):
+         isSent, response = self.sendText('echo', 'msg%d' % i)
+         self.assertTrue(isSent)
+         self.assertEqual('MSG%d' % i, response.getTextPayload())
+
+   def testIdleSocketsCapped(self):
+      FakeSocket.server = FakeServer()
+      messaging = Messaging.getMessaging()
+      sockets = [FakeSocket('localhost', 9000) for i in range(tonnerre._MAX_IDLE_SOCKETS + 2)]
+      for s in sockets:
+         messaging.checkInSocket('echo', s)
+      self.assertEqual(tonnerre._MAX_IDLE_SOCKETS, len(messaging.socketPool['echo']))
+      self.assertTrue(sockets[-1].closed)
+
+   def testCloseSockets(self):
+      FakeSocket.server = FakeServer()
+      self.sendText('echo', 'warmup')
+      messaging = Messaging.getMessaging()
+      pooled = messaging.socketPool['echo'][0]
+      messaging.closeSockets()
+      self.assertTrue(pooled.closed)
+      self.assertEqual(None, messaging.checkOutSocket('echo'))
+
+   def testConcurrentSendsDontShareSockets(self):
+      FakeSocket.server = FakeServer()
+      failures = []
+
+      def worker(workerId):
+         for i in range(50):
+            text = 'w%d-%d' % (workerId, i)
+            isSent, response = self.sendText('echo', text)
+            if (not isSent) or (response.getTextPayload() != text.upper()):
+               failures.append(text)
+
+      threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+      for t in threads:
+         t.start()
+      for t in threads:
+         t.join()
+
+      self.assertEqual([], failures)
+
+#******************************************************************************
+
+def kvpToDict(kvp):
+   return dict([(key, kvp.getValue(key)) for key in kvp.getKeys()])
+
+def makeKvp(pairs):
+   kvp = KeyValuePairs()
+   for key, value in pairs:
+      kvp.addPair(key, value)
+   return kvp
+
+#******************************************************************************
+
+class TestMessageSerialization(unittest.TestCase):
+
+   def roundTrip(self, message):
+      return Message.reconstruct(StringReader(message.toString()))
+
+   def testKeyValuesRoundTrip(self):
+      msg = Message('echo', MessageType.KeyValues)
+      msg.setKeyValuesPayload(makeKvp([('stooge1', 'Moe'), ('stooge2', 'Larry')]))
+      received = self.roundTrip(msg)
+      self.assertEqual(MessageType.KeyValues, received.getType())
+      self.assertEqual('echo', received.getRequestName())
+      self.assertEqual({'stooge1': 'Moe', 'stooge2': 'Larry'}, kvpToDict(received.getKeyValuesPayload()))
+
+   def testResendReceivedKeyValues(self):
+      msg = Message('echo', MessageType.KeyValues)
+      msg.setKeyValuesPayload(makeKvp([('a', '1'), ('b', '2')]))
+      received = self.roundTrip(msg)
+      # sent again without ever materializing the KeyValuePairs payload
+      resent = self.roundTrip(received)
+      self.assertEqual({'a': '1', 'b': '2'}, kvpToDict(resent.getKeyValuesPayload()))
+
+   def testSetKeyValuesPayloadReplacesReceived(self):
+      msg = Message('echo', MessageType.KeyValues)
+      msg.setKeyValuesPayload(makeKvp([('a', '1')]))
+      received = self.roundTrip(msg)
+      received.setKeyValuesPayload(makeKvp([('c', '3')]))
+      self.assertEqual({'c': '3'}, kvpToDict(received.getKeyValuesPayload()))
+      resent = self.roundTrip(received)
+      self.assertEqual({'c': '3'}, kvpToDict(resent.getKeyValuesPayload()))
+
+   def testReceivedPayloadReplacesPreviousKvp(self):
+      msg = Message('echo', MessageType.KeyValues)
+      msg.setKeyValuesPayload(makeKvp([('new', 'value')]))
+      response = Message()
+      response.setKeyValuesPayload(makeKvp([('old', 'value')]))
+      self.assertTrue(response.reconstitute(StringReader(msg.toString())))
+      self.assertEqual({'new': 'value'}, kvpToDict(response.getKeyValuesPayload()))
+
+   def testEmptyKeyValuesPayload(self):
+      msg = Message('echo', MessageType.KeyValues)
+      msg.setKeyValuesPayload(KeyValuePairs())
+      received = self.roundTrip(msg)
+      self.assertEqual(MessageType.KeyValues, received.getType())
+      self.assertEqual(None, received.getKeyValuesPayload())
+
+   def testParsePairs(self):
+      self.assertEqual([('a', '1'), ('b', '2')], tonnerre._parsePairs('a=1;b=2'))
+
+   def testParsePairsValueContainingDelimiter(self):
+      # split at the first '=' only; StringTokenizer rejected these pairs
+      self.assertEqual([('a', 'b=c')], tonnerre._parsePairs('a=b=c'))
+
+   def testParsePairsEmptyValue(self):
+      # kept with an empty value; StringTokenizer rejected these pairs
+      self.assertEqual([('k', '')], tonnerre._parsePairs('k='))
+
+   def testParsePairsSkipsMalformed(self):
+      self.assertEqual([('a', '1')], tonnerre._parsePairs('novalue;a=1'))
+      self.assertEqual([('a', '1'), ('b', '2')], tonnerre._parsePairs('a=1;;b=2;'))
+      self.assertEqual([], tonnerre._parsePairs(''))
+
+#******************************************************************************
+
+class TestMessageHeaders(unittest.TestCase):
+
+   def roundTrip(self, message):
+      return Message.reconstruct(StringReader(message.toString()))
+
+   def testKvpHeadersWritesThrough(self):
+      msg = Message('echo', MessageType.Text)
+      msg.setTextPayload('text')
+      msg.kvpHeaders.addPair('custom', 'v')
+      self.assertTrue(msg.kvpHeaders.hasKey('custom'))
+      received = self.roundTrip(msg)
+      self.assertEqual('v', received.getHeader('custom'))
+
+   def testKvpHeadersRemovePair(self):
+      msg = Message('echo', MessageType.Text)
+      msg.setHeader('custom', 'v')
+      msg.kvpHeaders.removePair('custom')
+      self.assertFalse(msg.hasHeader('custom'))
+
+   def testAssignKvpHeaders(self):
+      headers = Message('echo').kvpHeaders
+      headers.addPair('custom', 'v')
+      msg = Message(None, MessageType.Text)
+      msg.setTextPayload('text')
+      msg.kvpHeaders = headers
+      received = self.roundTrip(msg)
+      self.assertEqual('echo', received.getRequestName())
+      self.assertEqual('v', received.getHeader('custom'))
+
+   def testSetHeader(self):
+      msg = Message('echo', MessageType.Text)
+      msg.setTextPayload('text')
+      msg.setHeader('custom', 'v')
+      received = self.roundTrip(msg)
+      self.assertTrue(received.hasHeader('custom'))
+      self.assertEqual('v', received.getHeader('custom'))
+      self.assertEqual(None, received.getHeader('missing'))
+
+#******************************************************************************
+
+class TestMessagingSingleton(unittest.TestCase):
+
+   def tearDown(self):
+      Messaging.setMessaging(None)
+
+   def testMessagingInstanceAttribute(self):
+      messaging = Messaging()
+      Messaging.setMessaging(messaging)
+      self.assertTrue(Messaging.messagingInstance is messaging)
+      Messaging.messagingInstance = None
+      self.assertFalse(Messaging.isInitialized())
+
+#******************************************************************************
+
+class TestMessageFreeList(unittest.TestCase):
+
+   def testDoubleReleaseDoesNotDuplicate(self):
+      message = Message()
+      Message.release(message)
+      Message.release(message)
+      first = Message.acquire()
+      second = Message.acquire()
+      self.assertTrue(first is not second)
+
+   def testAcquireFromEmptyFreeList(self):
+      del Message._freelist[:]
+      self.assertTrue(isinstance(Message.acquire(), Message))
+
+#******************************************************************************
+#******************************************************************************
+
+if __name__ == '__main__':
+   unittest.main()
+
+#******************************************************************************
+#******************************************************************************